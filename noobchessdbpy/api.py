@@ -28,6 +28,10 @@ See also the docstrings of these objects.
 
 This module is *nearly* eventloop agnostic, consisting only of async functions and methods plus a brief reference to
 `trio.sleep` for implementing retries. In principle it's nearly trivial to use a different eventloop with this module.
+
+If `orjson` is installed, it's used to decode CDB's responses, which is considerably faster than the stdlib `json` for
+large mass requests. Otherwise the stdlib is used, with identical results. Likewise, if `h2` is installed (as with
+`httpx[http2]`), requests are multiplexed over HTTP/2 connections, falling back to HTTP/1.1 if the server declines.
 '''
 
 __all__ = ['CDBStatus', 'CDBError', 'AsyncCDBClient']
@@ -35,14 +39,28 @@ __all__ = ['CDBStatus', 'CDBError', 'AsyncCDBClient']
 ########################################################################################################################
 
 from enum import Enum, auto
+import math
 
 import chess
 import httpx
 import trio
 
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+try:
+    import h2 # not used directly, but httpx refuses `http2=True` without it
+except ImportError:
+    _HTTP2 = False
+else:
+    _HTTP2 = True
+
 ########################################################################################################################
 
 _CDBURL = 'https://www.chessdb.cn/cdb.php'
+_MAX_RETRY_AFTER = 300 # seconds, however long the server asks us to wait
 
 class CDBStatus(Enum):
     '''
@@ -87,6 +105,9 @@ class CDBError(Exception):
 # current testing indicates max rate of ~400-500 req/s, with no added rate above concurrency=256, on my cpu at least
 # currently unknown what is the bottleneck. maybe chess.Board.fen()?
 
+# there's no batch endpoint: every action takes exactly one board, so N positions means N requests. the closest we can
+# get to batching is HTTP/2, multiplexing those requests over a few connections (see `_HTTP2`)
+
 
 class AsyncCDBClient(httpx.AsyncClient):
     '''
@@ -147,7 +168,6 @@ class AsyncCDBClient(httpx.AsyncClient):
         if 'args' in kwargs:
             del kwargs['args']
 
-    # TODO: http2?
     def __init__(self, **kwargs):
         '''
         This `httpx.AsyncClient` subclass may be initialized with any kwargs of the parent class.
@@ -169,7 +189,7 @@ class AsyncCDBClient(httpx.AsyncClient):
                         'limits':   httpx.Limits(max_keepalive_connections=None,
                                                  max_connections=None,
                                                  keepalive_expiry=30),
-                        #'http2':    True,
+                        'http2':    _HTTP2, # many requests on few connections, fewer TLS handshakes
                       }
         super().__init__(**super_kwargs, **kwargs)
 
@@ -179,14 +199,14 @@ class AsyncCDBClient(httpx.AsyncClient):
     # First the under-the-hood internals common to each, every, any request made thru this API.
 
     _known_cdb_params = {"action", "move", "showall", "learn", "egtbmetric", "endgame"}
-    @staticmethod
-    def _prepare_params(kwargs, board:chess.Board=None):
+    @classmethod
+    def _prepare_params(cls, kwargs, board:chess.Board=None):
         '''
         Prepare the parameters to the GET request (or return CDBStatus.GameOver or raise a CDBError)
         '''
         for kw in kwargs:
-            if kw not in _known_cdb_params:
-                raise CDBError(f"unknown api argument: {kw} (should be from {_known_cdb_args})")
+            if kw not in cls._known_cdb_params:
+                raise CDBError(f"unknown api argument: {kw} (should be from {cls._known_cdb_params})")
         kwargs['json'] = 1
         if board:
             if board.is_game_over():
@@ -229,12 +249,13 @@ class AsyncCDBClient(httpx.AsyncClient):
                 if i == 0:
                     raise err
                 else:
+                    wait = _retry_after(err)
                     # possible extra newline to break \r stuff
                     print(('\n' if i == num_retries-1 else '') + f"caught HTTP error on {action} for {board=}:"
-                          f" {err!r} retrying, have {i} retries left, waiting 20s...")
-                    await trio.sleep(20)
+                          f" {err!r} retrying, have {i} retries left, waiting {wait:g}s...")
+                    await trio.sleep(wait)
             else: # HTTP success
-                json = resp.json()
+                json = _json_loads(resp.content)
                 self._parse_status(json, board, raisers)
                 if json['status'] is CDBStatus.LimitExceeded and self.autoclear and action != 'clearlimit':
                     cs = await self._clear_limit() # recursion, but hopefully guarded here ^^ against infinite recursion
@@ -346,7 +367,7 @@ class AsyncCDBClient(httpx.AsyncClient):
 
         returns a CDBStatus (or possibly raise a CDBError)
         '''
-        json = await self._cdb_request(board, action=action, **kwargs)
+        json = await self._cdb_request(board, raisers=raisers, action=action, **kwargs)
         return json['status']
 
     async def queue(self, board:chess.Board, raisers:set=None, **kwargs) -> CDBStatus:
@@ -371,6 +392,25 @@ class AsyncCDBClient(httpx.AsyncClient):
 # end class AsyncCDBClient
 ########################################################################################################################
 
+def _retry_after(err:httpx.HTTPError, default:float=20) -> float:
+    '''
+    Seconds to wait before retrying a failed request: as asked by the server's Retry-After header, if any (e.g. with 429
+    Too Many Requests or 503), else `default`. Only the delay-seconds form of the header is understood, and waits are
+    capped at `_MAX_RETRY_AFTER`, lest a bogus header stall every request indefinitely.
+    '''
+    if not isinstance(err, httpx.HTTPStatusError):
+        return default
+    try:
+        wait = float(err.response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return default
+    if not math.isfinite(wait): # float() happily accepts 'inf' and 'nan'
+        return default
+    if wait > _MAX_RETRY_AFTER:
+        print(f"\nserver asked to wait {wait:g}s before retrying, capping the wait at {_MAX_RETRY_AFTER}s")
+        return _MAX_RETRY_AFTER
+    return max(0.0, wait)
+
 def strip_fen(fen:str):
     '''
     CDB ignores the last two FEN fields, and this will strip them. In uncommon cases, two positions may be identical
@@ -22,16 +22,20 @@ Since we want to keep reusing one http client, the algorithms are all implemente
 API client: `AsyncCDBLibrary`. Create an instance of this class to use the algorithms. Arguments are generally `chess`
 objects.
 
-In addition to the main algorithms class, this module also exposes a static `parse_pgn_to_set` function, as well as
-some helper classes `BreadthFirstState` and `CircularRequests`, and also the enum `CDBArgs` for use in scripts which
-call this library.
+In addition to the main algorithms class, this module also exposes static `parse_pgn_to_set` functions, as well as
+some helper classes `BreadthFirstState`, `CircularRequests`, `BloomFilter`, `Int64Set` and `DiskDeque`, and also the
+enum `CDBArgs` for use in scripts which call this library.
 
 Checkout the docstrings of all these things to get started -- or read the example scripts!
 '''
 
 ########################################################################################################################
 
+from bisect import bisect_right
+from contextlib import redirect_stdout
 import math
+import multiprocessing
+import os
 from typing import Iterable
 
 import chess
@@ -39,13 +43,19 @@ import chess.pgn
 import trio
 import traceback
 
-from ..api import AsyncCDBClient, CDBStatus, strip_fen
+from ..api import AsyncCDBClient, CDBStatus
 from . import _chess_extensions
+from ._chess_extensions import comment_pv_san
 from ._stateful_iterators import BreadthFirstState, CircularRequesters, __all__ as _s_i_all__
+from ._compact_sets import BloomFilter, Int64Set, __all__ as _c_s_all__
+from ._disk_deque import DiskDeque, __all__ as _d_d_all__
 from ._script_args import CDBArgs, __all__ as _s_a_all__
 # The contents of _stateful_iterators are exposed via this module, but separate files for better focus when reading
 
-__all__ = ['AsyncCDBLibrary', 'parse_pgn_to_set'] + _s_i_all__ + _s_a_all__
+__all__ = (['AsyncCDBLibrary', 'parse_pgn_to_set', 'parse_pgn_to_set_parallel']
+           + _s_i_all__ + _c_s_all__ + _d_d_all__ + _s_a_all__)
+
+_PRINT_INTERVAL = 0.1 # seconds between progress prints, stdout is surprisingly expensive in the hot loops
 
 ########################################################################################################################
 
@@ -67,27 +77,47 @@ class AsyncCDBLibrary(AsyncCDBClient):
     ####################################################################################################################
     ####################################################################################################################
     # First, basic some examples of "flat" concurrency: spawn one task per input, ez, simple. The catch is that thousands
-    # of inputs would spawn thousands of tasks, so this isn't useful for more than a few hundred requests.
+    # of inputs would spawn thousands of tasks, so we cap the tasks in flight at `self.concurrency`, but even so this
+    # isn't meant for more than a few hundred requests.
 
     async def queue_single_line(self, pgn:chess.pgn.GameNode):
         '''Given a single line of moves, `queue` for analysis all positions in this line.'''
         # chess.pgn handles variations, and silently we don't actually verify if this pgn has no variations.
-        n = 0
-        async with trio.open_nursery() as nursery:
-            for node in pgn.mainline():
-                nursery.start_soon(self.queue, node.board())
-                n += 1
+        n = await self._request_in_order(self.queue, self._mainline_boards(pgn))
         print(f"completed {n} queues")
 
     async def query_reverse_single_line(self, pgn:chess.pgn.GameNode):
         '''Given a single line of moves, `query` in reverse the positions to aid backpropagation.'''
+        n = await self._request_in_order(self.query_all, reversed(self._mainline_boards(pgn)))
+        print(f"completed {n} queries")
+
+    @staticmethod
+    def _mainline_boards(pgn:chess.pgn.GameNode):
+        # walk forward once with a single board, since each ChildNode.board() replays the whole line from the root.
+        # the copies keep their move stacks like ChildNode.board() does, for the repetition check in `_prepare_params`
+        board, boards = pgn.board(), []
+        for node in pgn.mainline():
+            board.push(node.move)
+            boards.append(board.copy())
+        return boards
+
+    async def _request_in_order(self, api_call, boards:Iterable):
         n = 0
+        semaphore = trio.Semaphore(self.concurrency)
         async with trio.open_nursery() as nursery:
-            for node in reversed(pgn.mainline()):
-                nursery.start_soon(self.query_all, node.board())
+            for board in boards:
+                # acquiring here rather than in the task dispatches the requests in order, no sleeping required
+                await semaphore.acquire() # released by the task when its request completes
+                nursery.start_soon(self._release_after, semaphore, api_call, board)
                 n += 1
-                await trio.sleep(0.001) # this doesn't guarantee order of query, but theoretically helps
-        print(f"completed {n} queries")
+        return n
+
+    @staticmethod
+    async def _release_after(semaphore:trio.Semaphore, api_call, *args):
+        try:
+            await api_call(*args)
+        finally:
+            semaphore.release()
 
     #
     ####################################################################################################################
@@ -112,6 +142,9 @@ class AsyncCDBLibrary(AsyncCDBClient):
         '''
         async with trio.open_nursery() as nursery:
             # in general, we use the "tasks close their channel" pattern
+            # One item per channel op: the whole producer->consumer handoff costs ~6us per item, small next to even the
+            # per-request `fen()` let alone the HTTP round trip, whereas batching would leave consumers idle at the end
+            # of smaller jobs (e.g. `query_bfs_filter_simple` batches of 16 * concurrency).
             send_taskqueue, recv_taskqueue = trio.open_memory_channel(self.concurrency)
             nursery.start_soon(producer_task, send_taskqueue, *producer_args)
 
@@ -171,12 +204,19 @@ class AsyncCDBLibrary(AsyncCDBClient):
 
     @staticmethod
     async def _query_fen_producer(send_taskqueue:trio.MemorySendChannel, fens:Iterable):
-        n = 0
+        # Pooling and recycling boards wouldn't help here: `Board.set_fen` costs as much as `Board(fen)` (~30us, nearly
+        # all of it parsing), and the boards are handed off to the consumers (and with `collect_results`, to the caller)
+        # Nor would parsing in a worker thread: it's pure python, so it holds the GIL anyways, and at ~30us per board the
+        # producer already outpaces any request rate CDB will tolerate by orders of magnitude.
+        # (Nor is the parse skippable by sending the FEN strings as is: the `GameOver` shortcircuit needs a board, and
+        # e.g. PGN-sourced sets include every game's final position.)
+        n, last_print = 0, 0.0
         async with send_taskqueue:
             for fen in fens:
                 await send_taskqueue.send(chess.Board(fen))
                 n += 1
-                if n & 0x3F == 0:
+                if (now := trio.current_time()) - last_print > _PRINT_INTERVAL:
+                    last_print = now
                     print(f"\rtaskqueued {n} requests", end='')
 
 
@@ -192,12 +232,13 @@ class AsyncCDBLibrary(AsyncCDBClient):
 
     @staticmethod
     async def _iterable_reader(send_taskqueue:trio.MemorySendChannel, iterable):
-        n = 0
+        n, last_print = 0, 0.0
         async with send_taskqueue:
             for board in iterable:
                 await send_taskqueue.send(board)
                 n += 1
-                if n & 0x3F == 0:
+                if (now := trio.current_time()) - last_print > _PRINT_INTERVAL:
+                    last_print = now
                     print(f"\rtaskqueued {n} requests", end='')
 
 
@@ -217,13 +258,27 @@ class AsyncCDBLibrary(AsyncCDBClient):
 
     @staticmethod
     async def _set_reader(send_taskqueue:trio.MemorySendChannel, fenset):
-        n = 0
+        n, last_print = 0, 0.0
         async with send_taskqueue:
-            while fenset: # maybe popping will free memory on the fly? otherwise should just use forloop... TODO
-                await send_taskqueue.send(chess.Board(fenset.pop()))
+            # popping doesn't shrink the set's table anyways, so peak memory is the same either way, and iterating is
+            # cheaper per element. just clear the set at the end to honor "consumes the given set"
+            for fen in fenset:
+                await send_taskqueue.send(chess.Board(fen))
                 n += 1
-                if n & 0x3F == 0:
+                if (now := trio.current_time()) - last_print > _PRINT_INTERVAL:
+                    last_print = now
                     print(f"\rtaskqueued {n} requests", end='')
+            fenset.clear()
+
+    async def mass_queue_stream(self, fens:Iterable):
+        '''
+        Given an iterable of FEN strings which is read lazily, such as an open file of one FEN per line (blank lines are
+        skipped), queue them all into the DB as fast as possible. Unlike the above, memory use doesn't grow with the
+        number of positions, so this pairs well with the `sink` argument of `parse_pgn_to_set`.
+        '''
+        print("now mass queueing streamed positions")
+        await self.mass_request(self.queue, self._query_fen_producer, filter(None, map(str.strip, fens)))
+        print("\nall streamed positions have been queued for analysis")
 
     #
     ####################################################################################################################
@@ -234,7 +289,10 @@ class AsyncCDBLibrary(AsyncCDBClient):
     async def query_breadth_first(self, bfs:BreadthFirstState, maxply=math.inf, count=math.inf):
         '''
         Query CDB positions in breadth-first order, using the given BreadthFirstState. Returns a list of the API's
-        json output.
+        json output, as `(board, json)` pairs.
+
+        The returned boards are shared with `bfs`, as the parents of its queued positions: they must not be modified
+        (push, pop, set_fen etc) if `bfs` is to be resumed, else later positions come out wrong. Copy them instead.
         '''
         return await self.mass_request(self.query_all,
                                        self._breadth_first_producer, bfs, maxply, count,
@@ -249,30 +307,47 @@ class AsyncCDBLibrary(AsyncCDBClient):
 
 
     async def query_bfs_filter_simple(self, pos:chess.Board, predicate, filter_count, maxply=math.inf, count=math.inf,
-                                                                                      batchsize=None):
+                                                                                      batchsize=None, **bfs_kwargs):
         '''
         Given a `predicate`, which is a function on (chess.Board, CDB's json data for that board) returning a bool,
-        search for `filter_count` positions which pass the filter, using mass queries of size `batchsize`. Returns a list
-        of such positions found. `batchsize` should be a multiple of `self.concurrency` for efficient use (default 16x).
+        search for `filter_count` positions which pass the filter, using mass queries of size `batchsize`. This is an
+        async generator: after each batch, it yields a list of that batch's `(board, json)` pairs passing the filter, so
+        that the caller may e.g. write them out as it goes, rather than losing everything to an interrupt. `batchsize`
+        should be a multiple of `self.concurrency` for efficient use (default 16x). Any further kwargs are passed to
+        `BreadthFirstState`, e.g. a `DiskDeque` queue and an `Int64Set` seen for searches too big for memory.
+
+        The yielded boards are copies, and so are the caller's to modify. The board passed to the `predicate` is not:
+        it's shared with the search, so the `predicate` must not modify it.
+
+        Usage: `async for found in lib.query_bfs_filter_simple(...): ...`
         '''
-        # TODO: this is a synchronous function lol
         if not batchsize:
             batchsize = 16 * self.concurrency
-        bfs = BreadthFirstState(pos)
-        # TODO: could yield each batch's results as it goes, to enable writing to file inbetween each batch, which
-        # would allow interuppting a too-long search
-        found = []
+        bfs = BreadthFirstState(pos, **bfs_kwargs)
         print(f"starting bfs filter search, limits: {maxply=} {count=}, target positions = {filter_count} ({batchsize=})")
-        n = 0
-        while n < count and len(found) < filter_count and bfs.relative_ply() <= maxply:
-            print(f"found {len(found)} from {n} queries, querying next batch...")
-            results = await self.query_breadth_first(bfs, maxply, count=batchsize)
-            n += len(results)
-            for board, response in results:
-                if response['status'] is CDBStatus.Success and predicate(board, response):
-                    found.append((board, response))
-        print(f"after {n} queries, found {len(found)} positions passing the predicate")
-        return found
+        n = f = 0
+
+        # The predicate is applied as each query completes, rather than to the batch's results at the end, so that the
+        # batch can be cancelled as soon as the target is reached, instead of finishing up to a whole batch of wasted
+        # queries. (Positions already taken from `bfs` but not yet queried are dropped, but then the search is over.)
+        async def query_filter(board):
+            nonlocal n
+            response = await self.query_all(board)
+            n += 1
+            # (other queries may complete in the same scheduling tick as the one reaching the target, hence the guard)
+            if f + len(found) < filter_count and response['status'] is CDBStatus.Success and predicate(board, response):
+                found.append((board.copy(stack=False), response)) # `board` is the parent of queued positions
+                if f + len(found) >= filter_count:
+                    cancel_scope.cancel()
+
+        while n < count and f < filter_count and bfs.relative_ply() <= maxply:
+            print(f"found {f} from {n} queries, querying next batch...")
+            found = []
+            with trio.CancelScope() as cancel_scope:
+                await self.mass_request(query_filter, self._breadth_first_producer, bfs, maxply, batchsize)
+            f += len(found)
+            yield found
+        print(f"after {n} queries, found {f} positions passing the predicate")
 
     # TODO: implement the "smart" bfs_filter using CircularRequesters (now that it's built)?
     #
@@ -295,11 +370,14 @@ class AsyncCDBLibrary(AsyncCDBClient):
         Such iteration is done by means of recursive `query_all` calls, in a more or less breadth-first order, altho
         with low branching factors the resulting tree can look rather like an MCTS tree with high selective depths.
 
-        Upon seeing a fresh node, before iterating into its near-best children, this calls the `visitor` so that the user
-        may take some custom action for themself. For example, the `visitor` may also issue a `queue` on the node (in
-        addition to the `query_all` that produced the node), or the `visitor` may apply some custom filtering of its own
-        for later return to the user. Indeed, the `visitor`'s return value is stored in a dict with structure
-        `{fenstr: visitor_retval}`, this dict being the return value of this function.
+        Upon seeing a fresh node, after queueing the `query_all`s of its near-best children, this calls the `visitor`
+        so that the user may take some custom action for themself. For example, the `visitor` may also issue a `queue`
+        on the node (in addition to the `query_all` that produced the node), or the `visitor` may apply some custom
+        filtering of its own for later return to the user. Indeed, the `visitor`'s return value is stored in a dict with
+        structure `{fenstr: visitor_retval}`, this dict being the return value of this function.
+        Since the children are requested first, any requests the visitor makes through `circular_requesters` are sent
+        after the children's, and the children's results may already be arriving by the time the visitor returns. The
+        visitor can't influence which children are iterated, nor can its requests get ahead of them.
 
         `visitor` must be a callable with the following signature:
         async def visitor(client:AsyncCDBClient, circular_requesters:CircularRequesters,
@@ -337,6 +415,7 @@ class AsyncCDBLibrary(AsyncCDBClient):
         s = qa = d = todo = seldepth = 0 # todo = queryalls sent but unprocessed, qa = qas processed,
         # s = nonleaf nodes ("stem") (possibly excluding root), d = duplicate hits
         baseply = rootboard.ply()
+        last_print = 0.0
 
         # Not thread safe to refer to variables outside the nursery scope (so to speak)
         try: # Recycle this indentation level...
@@ -365,37 +444,46 @@ class AsyncCDBLibrary(AsyncCDBClient):
                 margin = max(round(cp_margin - margin_decay * relply), 0)
                 #print('\n', f"{relply=}, {cp_margin=}, {margin_decay=}, {margin=}")
 
+                # Iterate before calling the visitor: the visitor has no say in which children we iterate into, so by
+                # sending their requests first, their round trips overlap with whatever the visitor does.
+                new_children = 0
+                if result['status'] is CDBStatus.Success and relply < maxply:
+                    moves = result['moves']
+                    score = moves[0]['score']
+                    if abs(score) <= 19000:
+                        score_margin = score - margin
+                        # moves are sorted by score, so binary search for the first one outside the margin
+                        cutoff = min(bisect_right(moves, -score_margin, key=lambda move: -move['score']), maxbranch)
+                        # One catch: a now-nonleaf may turn out to have entirely transposing children, which makes it a
+                        # leaf
+                        for move in moves[:cutoff]:
+                            # the stack is kept for visitors which want the line (e.g. `near_pv_save_lines.py`). The
+                            # moves are CDB's own legal moves for this very board, so skip `push_uci`'s legality check
+                            child = board.copy(stack=True)
+                            child.push(chess.Move.from_uci(move['uci']))
+                            #print(f"iterating into {move['san']}")
+                            unique = await circular_requesters.make_request(self.query_all, (child,))
+                            if unique:
+                                new_children += 1
+                            else:
+                                d += 1
+
                 # result may still be json or a CDBStatus, give the visitor a chance to act on that
                 vres = await visitor(self, circular_requesters, board, result, margin, relply, maxply)
                 if vres: # len(all_results) is at least s but also includes "leaves" which have only transposing children
-                    all_results[strip_fen(board.fen())] = vres # board.fen() remains monumentally expensive
+                    all_results[board.cdb_fen()] = vres # same key as strip_fen(board.fen()), at under half the cost
 
-                # having given the visitor its chance, now we iterate
                 if result['status'] is not CDBStatus.Success or relply >= maxply:
                     continue
-                moves = result['moves']
-                score = moves[0]['score']
                 if abs(score) > 19000:
                     return
-
-                score_margin = score - margin
-                # One catch: a now-nonleaf may turn out to have entirely transposing children, which makes it a leaf
-                new_children = 0
-                for i, move in enumerate(moves):
-                    if i >= maxbranch or move['score'] < score_margin:
-                        break
-                    child = board.copy(stack=True)
-                    child.push_uci(move['uci'])
-                    #print(f"iterating into {move['san']}")
-                    unique = await circular_requesters.make_request(self.query_all, (child,))
-                    if unique:
-                        new_children += 1
-                    else:
-                        d += 1
                 if not new_children:
                     continue # no printing for you, transposing node!
                 todo += new_children
                 s += 1
+                if (now := trio.current_time()) - last_print <= _PRINT_INTERVAL:
+                    continue
+                last_print = now
                 _s = s + (qa <= 1) # for branching factor we divide by nonleaves, but if root is a leaf then that would be 0/0
                 print(f"\rnodes={qa} stems={s} ply={relply} {margin=} {score=} br={new_children}"
                       f" brf={(qa-1+todo)/_s:.2f} dups={d} {todo=} t/n={todo/qa:.2%}:"
@@ -445,7 +533,82 @@ def count_fortressness(board, cdb_moves):
 
 ########################################################################################################################
 
-def parse_pgn_to_set(filehandle, start=0, count=math.inf):
+class _PositionVisitor(chess.pgn.BaseVisitor):
+    '''
+    A `chess.pgn.read_game` visitor which passes each position of the game to `record` as soon as it's parsed, including
+    the positions of any PVs in comments. Unlike the default `GameBuilder`, no `GameNode` tree is ever built, which
+    costs more than the positions themselves. `read_game` returns (count of nodes, count of pre-dedup positions).
+
+    Comments are attached to nodes exactly as `GameBuilder` would do, but a PV is only played out once its node is
+    complete, i.e. once all its comments are read: at the next move, the end of the variation or the end of the game.
+    '''
+    def __init__(self, record):
+        self.record = record
+
+    def begin_game(self):
+        # `board` is the parser's own board for the current line, at the current node. The parser mutates it as it goes,
+        # so it's borrowed rather than copied: anything pushed onto it must be popped again.
+        self.board, self.moved, self.in_variation, self.comment, self.stack = None, False, False, '', []
+        self.m = self.n = 0
+
+    def visit_move(self, board, move):
+        self._end_node()
+        self.moved = self.in_variation = True
+
+    def visit_board(self, board):
+        # called with the starting position, then after each move is pushed (or fails to parse)
+        if self.moved or self.board is None:
+            self.board, self.moved = board, False
+            self.record(board)
+            self.m += 1; self.n += 1
+
+    def visit_comment(self, comment):
+        if self.in_variation: # otherwise, it's a comment on the game or a starting comment, which have no PVs
+            self.comment = f"{self.comment} {comment}" if self.comment else comment
+
+    def begin_variation(self):
+        # the variation's parent node isn't complete, since a comment may follow the variation
+        self.stack.append((self.board, self.comment))
+        self.comment, self.in_variation = '', False
+
+    def end_variation(self):
+        self._end_node()
+        self.board, self.comment = self.stack.pop()
+
+    def end_game(self):
+        self._end_node()
+
+    def result(self):
+        return self.m, self.n
+
+    def handle_error(self, error):
+        chess.pgn.LOGGER.exception("error during pgn parsing") # as does `GameBuilder`, which also continues
+
+    def _end_node(self):
+        if not self.comment or not (comment_pv_sans := comment_pv_san(self.comment)):
+            self.comment = ''
+            return
+        self.comment = ''
+        self.n += len(comment_pv_sans)
+        # The pv originates from the parent. Play it out on `board` itself, then unwind it. The first pv move is usually
+        # the move played, whose position was already recorded, so that's skipped here.
+        board = self.board
+        move = board.pop()
+        #if comment_pv_sans[0] != board.san(move):
+        #    print(f"ply {board.ply()}: found node where move played differs from pv! {board.san(move)} vs {comment_pv_sans[0]} ")
+        depth, sans = len(board.move_stack), iter(comment_pv_sans)
+        if board.parse_san(comment_pv_sans[0]) == move:
+            board.push(move)
+            next(sans)
+        for san in sans:
+            board.push_san(san)
+            self.record(board)
+        while len(board.move_stack) > depth:
+            board.pop()
+        board.push(move)
+
+
+def parse_pgn_to_set(filehandle, start=0, count=math.inf, *, sink=None, seen=None):
     '''
     Read one PGN file: load any and all positions found in the file into memory, including all PVs in comments.
     Deduplicate, returning a set of FENs. With large files, can cause large memory consumption.
@@ -457,6 +620,12 @@ def parse_pgn_to_set(filehandle, start=0, count=math.inf):
     no more than `count`.
 
     returns (set of unique-ified parsed postions, count of pre-dedup positions seen)
+
+    Alternatively, to avoid holding all the FENs in memory, pass a callable `sink`, e.g. one which writes to a file: each
+    unique FEN is passed to it as soon as it's found, rather than collected in the set. Deduplication is then done
+    by `chess.Board.cdb_hash` in `seen`, by default a new `set`. To cross-deduplicate several files, pass the same `seen`
+    for each; for really large inputs, pass an `Int64Set` or `BloomFilter`. In this mode, returns (count of unique
+    positions passed to `sink`, count of pre-dedup positions seen).
     '''
     print(f"reading '{filehandle.name}' ...")
 
@@ -468,53 +637,91 @@ def parse_pgn_to_set(filehandle, start=0, count=math.inf):
         #print(f"skipped a game, {_start} to go")
     if _start > 0:
         print(f"still need to skip {_start} games but no more in the file")
-        return set(), 0
+        return (set() if sink is None else 0), 0
 
-    games = []
-    n = 0
-    while n < count and (game := chess.pgn.read_game(filehandle)) is not None:
-        games.append(game)
-        n += 1
-    if n < count < math.inf:
-        print(f"read only {n} games instead of {count} from {filehandle.name}")
+    if sink is None:
+        all_positions = set()
+        positions = []
+        def record(board):
+            positions.append(board.cdb_fen())
     else:
-        print(f"read {n} games from {filehandle.name}")
-    # no real way to validate the parsed data, just assume it's good and hope for the best
-
-    all_positions = set()
-    x = 0
-    for i, game in enumerate(games, start=start+1):
-        n = m = 0
-        #print(f"processing game {i}")
-        for node in game.all_variations():
-            parent = node.parent
-            if parent:
-                pboard = node.parent.board() # TODO: ChildNode.board() is very, very expensive, refactor?
-                board = pboard.copy(stack=False)
-                board.push(node.move)
-                #print(f"just added node {m}, reached by {pboard.san(node.move)}, now checking comment for pv...")
-            else:
-                board = node.board()
-                pboard = None
-            all_positions.add(strip_fen(board.fen()))
-            n += 1
-            m += 1
-
-            if pboard:
-                comment_pv_sans = node.parse_comment_pv_san()
-                if comment_pv_sans:
-                    n += len(comment_pv_sans)
-                    #print(f"found comment pv at board:\n{board}\nadding {len(comment_pv_sans)} positions")
-                    # generally, the first move of pv is the same as the played move, but rarely not
-                    #if comment_pv_sans[0] != node.san():
-                    #    print(f"game {i}, ply {board.ply()}: found node where move played differs from pv! {node.san()} vs {comment_pv_sans[0]} ")
-                    for fen in pboard.yield_fens_from_sans(comment_pv_sans):
-                        all_positions.add(strip_fen(fen))
+        if seen is None:
+            seen = set()
+        unique = 0
+        def record(board): # only serialize positions not already seen
+            nonlocal unique
+            if (key := board.cdb_hash()) not in seen:
+                seen.add(key)
+                sink(board.cdb_fen())
+                unique += 1
+
+    # Each game is processed as it's parsed, without building its `GameNode` tree, so not even one game is in memory.
+    # No real way to validate the parsed data, just assume it's good and hope for the best
+    visitor = _PositionVisitor(record)
+    x = g = 0
+    while g < count and (nodes_positions := chess.pgn.read_game(filehandle, Visitor=lambda: visitor)) is not None:
+        g += 1
+        i = start + g
+        m, n = nodes_positions
+        if sink is None:
+            all_positions.update(positions)
+            positions.clear()
         print(f"in game {i} found {m} nodes, {n} positions")
         x += n
-    unique = len(all_positions)
+    if g < count < math.inf:
+        print(f"read only {g} games instead of {count} from {filehandle.name}")
+    else:
+        print(f"read {g} games from {filehandle.name}")
+    if sink is None:
+        unique = len(all_positions)
     print(f"after deduplicating {filehandle.name}, found {unique} unique positions "
-          f"from {x} total, {unique/x:.2%} unique rate")
-    return all_positions, x # hopefully all the other crap here is garbage-collected quickly, freeing memory
+          f"from {x} total, {unique/x if x else math.nan:.2%} unique rate")
+    if sink is None:
+        return all_positions, x # hopefully all the other crap here is garbage-collected quickly, freeing memory
+    return unique, x
+
 
+def parse_pgn_to_set_parallel(filename, start=0, count=math.inf, processes=None):
+    '''
+    Like `parse_pgn_to_set`, but parse the games of one PGN file in parallel across `processes` worker processes
+    (default: all cpus), merging their sets. Unlike `parse_pgn_to_set`, this takes a filename rather than a filehandle,
+    since each worker opens the file for itself.
 
+    The file is first scanned once for the offset of each game (reading only the headers), then the games are split into
+    shards, so that each worker seeks directly to its games. Per-game output is suppressed in the workers.
+
+    returns (set of unique-ified parsed postions, count of pre-dedup positions seen)
+    '''
+    print(f"scanning '{filename}' for games ...")
+    offsets = []
+    with open(filename) as filehandle:
+        while len(offsets) < start + count:
+            offset = filehandle.tell()
+            if chess.pgn.read_headers(filehandle) is None:
+                break
+            offsets.append(offset)
+    offsets = offsets[start:]
+    if not offsets:
+        print(f"no games to read from {filename} after skipping {start}")
+        return set(), 0
+    processes = processes or os.cpu_count()
+    # several shards per worker, to even out the load when games vary in length
+    shardsize = max(1, math.ceil(len(offsets) / (4 * processes)))
+    shards = [(filename, offsets[i], min(shardsize, len(offsets) - i)) for i in range(0, len(offsets), shardsize)]
+    print(f"parsing {len(offsets)} games from {filename} in {len(shards)} shards with {processes} processes")
+
+    all_positions, x = set(), 0
+    with multiprocessing.Pool(processes) as pool:
+        for positions, n in pool.imap_unordered(_parse_pgn_shard, shards):
+            all_positions |= positions
+            x += n
+    unique = len(all_positions)
+    print(f"after deduplicating {filename}, found {unique} unique positions "
+          f"from {x} total, {unique/x if x else math.nan:.2%} unique rate")
+    return all_positions, x
+
+def _parse_pgn_shard(shard):
+    filename, offset, count = shard
+    with open(filename) as filehandle, open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        filehandle.seek(offset)
+        return parse_pgn_to_set(filehandle, 0, count)
@@ -16,8 +16,8 @@
 #    See the LICENSE file for more details.
 
 '''
-This module adds some extra methods/algorithms to some `chess` classes for use in this package, exposing no symbols of
-its own.
+This module adds some extra methods/algorithms to some `chess` classes for use in this package, exposing only the odd
+helper of its own which has no business being a method.
 '''
 
 ########################################################################################################################
@@ -26,12 +26,22 @@ import chess
 import chess.pgn
 from typing import Iterable
 
-__all__ = [] # this module only modifies other modules
+__all__ = ['comment_pv_san'] # this module mostly modifies other modules
 
 ########################################################################################################################
 # Manually extend chess.Board with a couple utility algorithms
-
-# TODO: apparently chess.Board.fen() is considerably expensive cpu-wise, altho the fenstr takes nearly 9x less memory...
+#
+# Why not a `chess.Board` subclass with `__slots__` instead? Because neither `chess.Board` nor `chess.BaseBoard` declare
+# `__slots__`, every instance has a `__dict__` regardless of what a subclass declares, so there's no memory to be saved.
+# Nor is method lookup any faster: methods assigned here live in the class dict exactly as if defined in a class body.
+# Meanwhile a subclass would exclude every board constructed by users or by `chess` itself (e.g. `GameNode.board()`).
+
+# chess.Board.fen() is considerably expensive cpu-wise (~20us, versus <1us for `cdb_hash`), altho the fenstr takes nearly
+# 9x less memory than the board. So the library only serializes a position when a string is really needed: once per
+# request sent to CDB, and once per position output (using `cdb_fen`, below, at well under half the cost). Anything
+# merely deduplicating uses `cdb_hash` instead.
+# Memoizing fen() on the board isn't worth it: boards are mutable, so every push/pop would have to invalidate the memo,
+# and after the above there are no repeated fen() calls on the same position left to save.
 def legal_child_fens(self, stack=True) -> Iterable:
     '''A generator over the `legal_moves` of `self`, yielding resulting fens.
     `stack` is the same as for `self.copy`.'''
@@ -55,9 +65,48 @@ def safe_peek(self):
     except IndexError:
         return None
 
+_EMPTY_RUNS = [('1' * n, str(n)) for n in range(8, 1, -1)]
+_PIECE_SYMBOLS = 'PNBRQK', 'pnbrqk'
+
+def cdb_fen(self) -> str:
+    '''
+    The FEN as CDB sees it, without the move counters: identical to `strip_fen(self.fen())` and to `self.epd()`, but
+    over twice as fast, building the piece placement from the bitboards rather than probing the 64 squares one by one.
+    '''
+    placement = ['1'] * 64
+    black, white = self.occupied_co
+    for bb, upper, lower in zip((self.pawns, self.knights, self.bishops, self.rooks, self.queens, self.kings),
+                                *_PIECE_SYMBOLS):
+        for square in chess.scan_forward(bb & white):
+            placement[square] = upper
+        for square in chess.scan_forward(bb & black):
+            placement[square] = lower
+    fen = '/'.join([''.join(placement[i:i+8]) for i in range(56, -1, -8)])
+    for run, n in _EMPTY_RUNS:
+        fen = fen.replace(run, n)
+    ep = chess.SQUARE_NAMES[self.ep_square] if self.has_legal_en_passant() else '-'
+    return f"{fen} {'w' if self.turn else 'b'} {self.castling_xfen()} {ep}"
+
+def cdb_hash(self) -> int:
+    '''
+    A 64-bit fingerprint identifying this position as CDB sees it, i.e. equivalent to `strip_fen(self.fen())` for
+    deduplication purposes, but without building any strings. (Pieces, turn, castling rights and legal ep square.)
+    Collisions are possible in principle, but negligible at any size we'll realistically reach. (Much cheaper to compute
+    than `chess.polyglot.zobrist_hash`, which loops over the pieces in pure python.)
+    '''
+    key = self._transposition_key()
+    # python hashes ints modulo 2**61 - 1, under which bits 61-63 alias bits 0-2, i.e. squares f8-h8 alias a1-c1: a queen
+    # on g8 hashes the same as a queen on b1. So the top three bits of each of the 8 bitboards are hashed separately.
+    top = 0
+    for bb in key[:8]:
+        top = (top << 3) | (bb >> 61)
+    return hash((key, top))
+
 chess.Board.legal_child_fens   = legal_child_fens
 chess.Board.yield_fens_from_sans = yield_fens_from_sans
 chess.Board.safe_peek = safe_peek
+chess.Board.cdb_fen = cdb_fen
+chess.Board.cdb_hash = cdb_hash
 
 ########################################################################################################################
 # Manually add some more methods to chess.pgn.GameNode
@@ -66,11 +115,14 @@ def parse_comment_pv_san(self):
     """
     Parse this node's comment for comma-separated key=value fields for the 'pv' field which is a list of SAN moves.
     In general we expect the PV to originate from this node's parent, and rarely may differ from this node's move.
+    """
+    return comment_pv_san(self.comment)
 
-    Uses `cur_board` to check if the first SAN duplicates the move leading to this node, and if so, excludes that first
-    SAN.
+def comment_pv_san(comment:str):
+    """
+    As `parse_comment_pv_san`, but for a bare comment string, for use where no `GameNode` is built (e.g. in a visitor).
     """
-    for f in self.comment.split(','):
+    for f in comment.split(','):
         f = f.strip()
         if f.startswith('pv'):
             pvfield = f
@@ -125,9 +177,17 @@ def all_variations(self) -> Iterable:
     An depth-first iterable yield `ChildNode`s from all variations starting from (and including) this node.
     """
     # could accept a visitor arg etc etc
+    # Iterative rather than recursive: nested `yield from` costs O(depth) per node yielded, and recursion would overflow
+    # on lines longer than the recursion limit. The stack holds the iterators over each pending node's variations.
+    # (To visit each position without building the tree at all, see the library's `_PositionVisitor` for `read_game`.)
     yield self
-    for vari in self.variations:
-        yield from vari.all_variations()
+    stack = [iter(self.variations)]
+    while stack:
+        if (node := next(stack[-1], None)) is None:
+            stack.pop()
+            continue
+        yield node
+        stack.append(iter(node.variations))
 
 chess.pgn.GameNode.parse_comment_pv_san = parse_comment_pv_san
 chess.pgn.GameNode.custom_add_line_san  = custom_add_line_san
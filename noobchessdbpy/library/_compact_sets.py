@@ -0,0 +1,155 @@
+#! python3.11, I think
+
+#    Copyright (C) 2023 Dubslow
+#
+#    This module is a part of the noobchessdbpy package.
+#
+#    This program is libre software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#    See the LICENSE file for more details.
+
+'''
+Compact alternatives to a python `set` for deduplicating positions in very large searches, where a `set` of even small
+keys (like `chess.Board.cdb_hash`) may consume more memory than is available.
+
+These support only the subset of the `set` interface actually needed for deduplication: `add` and `in`.
+'''
+
+########################################################################################################################
+
+from array import array
+import math
+
+__all__ = ['BloomFilter', 'Int64Set']
+
+########################################################################################################################
+
+class BloomFilter:
+    '''
+    A classic Bloom filter over 64-bit int keys (such as `chess.Board.cdb_hash`): `key in bloom` is never wrong when it
+    says no, but may be wrong when it says yes, with probability about `error_rate` once `capacity` keys have been added.
+    (Beyond `capacity`, the false positive rate climbs steadily.) For deduplication, a false positive means a position
+    is wrongly skipped as already seen.
+
+    Memory use is about -ln(error_rate)/ln(2)^2 bits per key, e.g. 3.6 bytes for the default 1e-6, versus roughly 60
+    bytes per int in a python `set`.
+    '''
+    def __init__(self, capacity:int, error_rate:float=1e-6):
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError(f"bad bloom filter parameters: {capacity=} {error_rate=}")
+        self.capacity, self.error_rate = capacity, error_rate
+        self.m = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2)**2)) # bits
+        self.k = max(1, round(self.m / capacity * math.log(2))) # probes per key
+        self.bits = bytearray((self.m + 7) // 8)
+        self.n = 0
+
+    # Double hashing: the k probes are h1, h1 + h2, h1 + 2*h2, ... (mod m), from the two 32-bit halves of the key. This
+    # is written out longhand in both methods, stepping the probe incrementally rather than with a generator, since this
+    # is per-position in the BFS hot loop. Most lookups there are misses, which usually return on the first probe or two.
+    def add(self, key:int):
+        key &= 0xFFFF_FFFF_FFFF_FFFF
+        m, bits = self.m, self.bits
+        j, step = (key & 0xFFFF_FFFF) % m, ((key >> 32) | 1) % m
+        for _ in range(self.k):
+            bits[j >> 3] |= 1 << (j & 7)
+            j += step
+            if j >= m:
+                j -= m
+        self.n += 1
+
+    def __contains__(self, key:int):
+        key &= 0xFFFF_FFFF_FFFF_FFFF
+        m, bits = self.m, self.bits
+        j, step = (key & 0xFFFF_FFFF) % m, ((key >> 32) | 1) % m
+        for _ in range(self.k):
+            if not bits[j >> 3] & (1 << (j & 7)):
+                return False
+            j += step
+            if j >= m:
+                j -= m
+        return True
+
+    def __len__(self):
+        '''The number of keys added, including duplicates'''
+        return self.n
+
+########################################################################################################################
+
+class Int64Set:
+    '''
+    An exact set of 64-bit int keys (such as `chess.Board.cdb_hash`), stored in a flat open-addressing table: unlike a
+    `BloomFilter` it never wrongly says yes, at the cost of about 8 / `maxload` bytes per key, i.e. 11-22 bytes at the
+    default load factor, versus roughly 60 bytes per int in a python `set`.
+
+    Lookups run in pure python, so they're a few times slower than a `set`'s, but that's still small next to the cost of
+    generating the positions being deduplicated. The table doubles whenever it exceeds `maxload`, which briefly needs
+    memory for both the old and new tables.
+    '''
+    _MULT = 0x9E37_79B9_7F4A_7C15 # 2**64 / golden ratio, for Fibonacci hashing
+    _MASK = 0xFFFF_FFFF_FFFF_FFFF
+
+    def __init__(self, capacity:int=1 << 10, maxload:float=0.75):
+        if capacity < 1 or not 0 < maxload < 1:
+            raise ValueError(f"bad set parameters: {capacity=} {maxload=}")
+        self.maxload = maxload
+        self.bits = max(3, math.ceil(math.log2(capacity / maxload)))
+        self.table = array('Q', bytes(8 << self.bits)) # 0 marks an empty slot...
+        self.limit = int(maxload * (1 << self.bits))
+        self.has_zero = False # ...so the key 0 is tracked separately
+        self.n = 0
+
+    # Multiplicative hashing takes the top `bits` bits of key * _MULT as the slot, then probes linearly. The probe loop is
+    # written out longhand in each method, since this is per-position in the BFS hot loop.
+    def add(self, key:int):
+        key &= self._MASK
+        if not key:
+            if not self.has_zero:
+                self.has_zero = True
+                self.n += 1
+            return
+        table, mask = self.table, (1 << self.bits) - 1
+        j = ((key * self._MULT) & self._MASK) >> (64 - self.bits)
+        while (k := table[j]):
+            if k == key:
+                return
+            j = (j + 1) & mask
+        table[j] = key
+        self.n += 1
+        if self.n > self.limit:
+            self._grow()
+
+    def __contains__(self, key:int):
+        key &= self._MASK
+        if not key:
+            return self.has_zero
+        table, mask = self.table, (1 << self.bits) - 1
+        j = ((key * self._MULT) & self._MASK) >> (64 - self.bits)
+        while (k := table[j]):
+            if k == key:
+                return True
+            j = (j + 1) & mask
+        return False
+
+    def _grow(self):
+        old = self.table
+        self.bits += 1
+        self.table = table = array('Q', bytes(8 << self.bits))
+        self.limit = int(self.maxload * (1 << self.bits))
+        mask, shift, mult, MASK = (1 << self.bits) - 1, 64 - self.bits, self._MULT, self._MASK
+        for key in old:
+            if key:
+                j = ((key * mult) & MASK) >> shift
+                while table[j]:
+                    j = (j + 1) & mask
+                table[j] = key
+
+    def __len__(self):
+        '''The number of distinct keys added'''
+        return self.n
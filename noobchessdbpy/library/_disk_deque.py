@@ -0,0 +1,104 @@
+#! python3.11, I think
+
+#    Copyright (C) 2023 Dubslow
+#
+#    This module is a part of the noobchessdbpy package.
+#
+#    This program is libre software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+#    See the LICENSE file for more details.
+
+'''
+A FIFO queue which spills to disk, for breadth-first searches whose frontier is too big to hold in memory.
+
+This supports only the subset of the `deque` interface actually needed for a FIFO queue: `append`, `popleft` and `len`.
+'''
+
+########################################################################################################################
+
+from collections import deque
+import pickle
+import tempfile
+
+__all__ = ['DiskDeque']
+
+########################################################################################################################
+
+class DiskDeque:
+    '''
+    A FIFO queue holding at most about `2 * chunksize` entries in memory: the oldest entries in a head `deque`, and the
+    newest in a tail `list`. Whenever the tail fills up, it's pickled as one chunk to an anonymous temporary file, and
+    whenever the head runs dry, it's refilled with the oldest chunk on disk (or else the tail). FIFO order is preserved.
+
+    Entries must be picklable. Pickling a whole chunk at once means objects shared between entries of the same chunk are
+    stored only once, e.g. the parent boards in `BreadthFirstState`'s queue, so on disk an entry costs tens of bytes.
+
+    The temporary file is deleted when the queue is garbage collected, or by `close`. While chunks remain on disk, the
+    file only grows; it's truncated whenever the disk chunks are all read back.
+    '''
+    def __init__(self, chunksize:int=1 << 16):
+        if chunksize < 1:
+            raise ValueError(f"chunksize must be at least 1 (got {chunksize})")
+        self.chunksize = chunksize
+        self.head = deque()
+        self.tail = []
+        self.file = None # created on first spill
+        self.chunks = 0 # on disk
+        self.read_pos = 0
+        self.n = 0
+
+    def append(self, x):
+        if not self.chunks and not self.tail and len(self.head) < self.chunksize:
+            self.head.append(x) # nothing newer is waiting, so skip the tail
+        else:
+            self.tail.append(x)
+            if len(self.tail) >= self.chunksize:
+                self._spill()
+        self.n += 1
+
+    def popleft(self):
+        if not self.head:
+            self._refill()
+        x = self.head.popleft() # raises IndexError when empty, like a deque
+        self.n -= 1
+        return x
+
+    def _spill(self):
+        if self.file is None:
+            self.file = tempfile.TemporaryFile()
+        self.file.seek(0, 2)
+        pickle.dump(self.tail, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.tail = []
+        self.chunks += 1
+
+    def _refill(self):
+        if self.chunks:
+            self.file.seek(self.read_pos)
+            self.head = deque(pickle.load(self.file))
+            self.read_pos = self.file.tell()
+            self.chunks -= 1
+            if not self.chunks: # reclaim the disk space
+                self.file.seek(0)
+                self.file.truncate()
+                self.read_pos = 0
+        else:
+            self.head = deque(self.tail)
+            self.tail = []
+
+    def __len__(self):
+        return self.n
+
+    def close(self):
+        '''Discard all entries and delete the temporary file'''
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.head, self.tail = deque(), []
+        self.chunks = self.read_pos = self.n = 0
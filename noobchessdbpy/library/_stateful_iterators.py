@@ -30,9 +30,9 @@ import math
 
 import chess
 import trio
-from trio.lowlevel import checkpoint
 
-from ..api import AsyncCDBClient, strip_fen
+from ..api import AsyncCDBClient
+from . import _chess_extensions
 
 __all__ = ['BreadthFirstState', 'CircularRequesters']
 
@@ -51,19 +51,74 @@ class BreadthFirstState:
     `rootpos.ply()`.
 
     `__init__` arg is the base position; state is remembered between each `iter_resume` call.
+
+    Positions are deduplicated by their `chess.Board.cdb_hash` in `seen`, by default a `set`. For very large searches,
+    any container supporting `add` and `in` may be passed instead: an `Int64Set` takes a fraction of the memory, and a
+    `BloomFilter` a fraction of that again, at the cost of a tiny rate of wrongly skipped positions. Likewise the
+    `queue` of the frontier may be any container supporting `append`, `popleft` and `len`, by default a `deque`; pass a
+    `DiskDeque` to spill the frontier to disk.
+
+    `maxqueue` bounds the length of the `queue` (give or take one position's children): while the queue is full, yielded
+    positions are set aside unexpanded, and expanded in turn as the queue drains. The order of iteration is unaffected.
+    A set-aside position costs one board, whereas its ~35 children would cost ~35 queue entries plus the same board.
+
+    Yielded boards are reused as the parents of queued positions, so they must not be modified (copy them instead).
     '''
-    def __init__(self, rootpos:chess.Board):
+    # a handful of instances at most, so this is about attribute access in the hot loops more than memory
+    __slots__ = ('rootpos', 'rootply', 'queue', 'seen', 'maxqueue', 'unexpanded', 'n', 'd', 'board')
+
+    def __init__(self, rootpos:chess.Board, seen=None, queue=None, maxqueue=math.inf):
         self.rootpos = rootpos.copy()
         self.rootply = self.rootpos.ply()
 
-        self.queue = deque(rootpos.legal_child_fens())
-        self.seen = set() # for deduplicating, fen should be stripped, however we rely on nonstripped context for maxply
+        # the queue holds (parent, move) rather than boards or fens: pushing one move onto a copy of the parent is far
+        # cheaper than fen() then reparsing it, and many children share one parent board in memory
+        self.queue = deque() if queue is None else queue
+        self.seen = set() if seen is None else seen
+        _sanitize_int_limit(maxqueue)
+        self.maxqueue = maxqueue
+        # yielded positions whose children aren't queued yet, in order. Children are always queued in the order of their
+        # parents, so deferring the expansion doesn't change the order of the queue, only its length
+        self.unexpanded = deque([self.rootpos])
         self.n = self.d = 0
         # if we've yielded `n` positions, and our tree has branching factor `b`, then on average the memory use is about
-        # `queue`: sizeof(chess.Board) * n * b (b ~ 35-40, so this is a lot)
-        #  `seen`: sizeof(fenstr) * n
-        self.fen = self.queue.popleft()
-        self.board = chess.Board(self.fen)
+        # `queue`: sizeof((parent, packed move)) * n * b (b ~ 35-40, so this is a lot)
+        #  `seen`: sizeof(int) * n * b
+        self.board = self._next_board()
+
+    def _enqueue_children(self, board):
+        # Positions are marked as seen when queued rather than when yielded, so that transpositions within the frontier
+        # are queued only once. In unlimited mode, the queue is on average "fucking big", so this matters when 1M nodes
+        # deep. Pushing and popping `board` itself is the cheapest way to get at the children's keys.
+        # This is the hottest loop in the package, and nearly all of its time is spent inside `chess` itself (mostly
+        # `push`); short of a compiled movegen, binding the method lookups to locals is the remaining cheap win.
+        # (But not `seen.__contains__`: for a `set`, the `in` operator is already a direct C call, and cheaper than calling
+        # a bound method. Nor can `filterfalse` help, since each child must be pushed before it can be hashed.)
+        push, pop, cdb_hash = board.push, board.pop, board.cdb_hash
+        seen, add, append = self.seen, self.seen.add, self.queue.append
+        d = 0
+        for move in board.generate_legal_moves():
+            push(move)
+            h = cdb_hash()
+            pop() # before queueing, in case the queue copies or pickles `board`
+            if h not in seen:
+                add(h)
+                append((board, move.from_square | move.to_square << 6 | (move.promotion or 0) << 12))
+            else:
+                d += 1
+        self.d += d
+
+    def _next_board(self):
+        # The child is only materialized here, when it's about to be yielded, rather than queueing a copy of each child:
+        # a queued board costs about a kilobyte, whereas a (parent, move) pair costs a tuple and a move, the parent being
+        # shared with its siblings. Either way there's no FEN parsing. The move is queued packed into one small int
+        # (from | to << 6 | promotion << 12), which halves the size of a queue entry versus a `chess.Move` object.
+        while self.unexpanded and len(self.queue) < self.maxqueue:
+            self._enqueue_children(self.unexpanded.popleft())
+        parent, move = self.queue.popleft()
+        board = parent.copy(stack=False)
+        board.push(chess.Move(move & 0x3F, move >> 6 & 0x3F, move >> 12 or None))
+        return board
 
     def iter_resume(self, maxply=math.inf, count=math.inf):
         _sanitize_int_limit(maxply)
@@ -71,22 +126,16 @@ class BreadthFirstState:
         n = 0
 
         print(f"starting bfs iter at relative ply {self.board.ply() - self.rootply} with {count=} {maxply=}")
-        while n < count and (self.board.ply() - self.rootply) <= maxply:
-            if strip_fen(self.fen) not in self.seen:
-                n += 1; self.n += 1
-                # In unlimited mode, the queue is on average "fucking big"
-                # surprisingly (to me at least), pre-filtering for duplicates here doesn't do much of anything
-                # altho even a little something might be a benefit when 1M nodes deep
-                self.queue.extend(filter(lambda f: strip_fen(f) not in self.seen,
-                                         self.board.legal_child_fens(stack=False)))
-                if self.n & 0x3F == 0: print(f"\rbfs: {self.n=} relative ply {self.board.ply() - self.rootply}", end='')
-                                             #{self.d=} {self.d/self.n=:.2%}")
-                self.seen.add(strip_fen(self.fen))
-                yield self.board
-            else:
-                self.d += 1
-            self.fen = self.queue.popleft()
-            self.board = chess.Board(self.fen)
+        # attribute loads hoisted out of the loop, `self.board` is kept in sync for `relative_ply` and the next resume
+        board, rootply, defer, next_board = self.board, self.rootply, self.unexpanded.append, self._next_board
+        while n < count and (relply := board.ply() - rootply) <= maxply:
+            # everything in the queue is unique, so no need to check `seen` here
+            n += 1; self.n += 1
+            defer(board) # expanded by `_next_board` as soon as there's room in the queue
+            if self.n & 0x3F == 0: print(f"\rbfs: {self.n=} relative ply {relply}", end='')
+                                         #{self.d=} {self.d/self.n=:.2%}")
+            yield board
+            self.board = board = next_board()
         print(f"\nfinished bfs iter at {n=}, relative ply {self.board.ply() - self.rootply}")
 
     def relative_ply(self):
@@ -106,8 +155,9 @@ class CircularRequesters:
 
     Public methods include `make_request`, `read_response`, `check_circular_busy`, and `stats`.
     '''
-    # Circluar memory channels. Determing when we're all done is a bit tricky: it's when all requesters are idle
-    # *and* there's no further results for the main task to process.
+    # Circluar memory channels. We're all done when every request sent has had its result read by the main task.
+    __slots__ = ('client', 'nursery', 'send_request', 'recv_request', 'send_results', 'recv_results', 'pending',
+                 'queued_keys', 'queried_keys', 'rs', 'rp')
 
     def __init__(self, active_client:AsyncCDBClient, active_nursery:trio.Nursery):
         '''
@@ -116,11 +166,17 @@ class CircularRequesters:
         self.client = active_client
         self.nursery = active_nursery
         self.send_request, self.recv_request = trio.open_memory_channel(self.client.concurrency)
-        self.send_results, self.recv_results = trio.open_memory_channel(math.inf) # sigh lol
+        self.send_results, self.recv_results = trio.open_memory_channel(max(64, 4 * self.client.concurrency))
         # channel data are (api_call, (args*)) or (api_call, (args*), result)
-        self.queued_fens, self.queried_fens = set(), set() # gotta be sure to not needlessly double up
+        # The main task must never block sending a request: if it did, while the requesters blocked sending it results,
+        # we'd deadlock. So requests which don't fit in the channel wait in `pending` until the requesters catch up.
+        # This way the backlog is stored as requests (a board apiece) rather than as results (a big json apiece), and
+        # the results channel can be bounded.
+        self.pending = deque()
+        # gotta be sure to not needlessly double up. keyed by `chess.Board.cdb_hash`, much cheaper than fen() strings
+        self.queued_keys, self.queried_keys = set(), set()
         # probably separate sets for queue and query_all is overkill
-        self.rs = self.rp = 0
+        self.rs = self.rp = 0 # requests sent and results read: the difference is the number in flight
 
         with self.recv_request, self.send_results: # close the originals to ensure that only channels in use are open
             for i in range(self.client.concurrency):
@@ -151,46 +207,46 @@ class CircularRequesters:
 
     async def check_circular_busy(self):
         '''
-        Use this to determine if there's still stuff for the main task to process.
-
-        This *should* be usable in a while loop condition without causing any deadlocking, tho I'm not fully certain
-        about that. But at least it's worked in practice so far
+        Use this to determine if there's still stuff for the main task to process, i.e. as a while loop condition.
         '''
-        # The basic idea is that we check if requesters are active, or if there're pending results for the main task to
-        # process.
-        await checkpoint() # The catch is that a requester may have received a response without having yet returned the
-        # result to the main task and gone idle. This await is necessary (sufficient?) for the main task to give way so
-        # that the requesters come fully idle after receiving a response. However, even with this checkpoint, I think it
-        # only works with "fair scheduling" where the checkpointing task is guaranteed to not resume control until all
-        # requesters have gone fully idle. I think...
-        # I remain scared that it's possible for this check to fail when it should pass, resulting in infinite blocking
-        # in self.read_response().
-        #print("looping...", (stats := self.recv_request.statistics()).tasks_waiting_receive, stats.open_receive_channels, self.recv_results.statistics().current_buffer_used)
-        stats = self.recv_request.statistics()
-        return (    stats.tasks_waiting_receive < stats.open_receive_channels # Are there any non-idle requesters?
-                or self.recv_results.statistics().current_buffer_used > 0)    # Or else are there pending results?
+        # Every request sent yields exactly one result, so we're busy precisely while some request hasn't had its result
+        # read yet: whether it's still pending, in a requester, or sitting in the results channel. Counting is exact, so
+        # unlike inspecting the channels' statistics, this can't race against a requester which has received a response
+        # but not yet sent the result.
+        self._flush_pending()
+        return self.rs > self.rp
 
     async def make_request(self, call, args): # little helper closure
         '''returns if request+board is unique (for `query_all` and `queue`) (the board is assumed to be the first arg)'''
-        fen = strip_fen(args[0].fen())
+        key = args[0].cdb_hash()
         if call == self.client.query_all:
-            if fen in self.queried_fens:
+            if key in self.queried_keys:
                 return False
-            self.queried_fens.add(fen)
+            self.queried_keys.add(key)
         elif call == self.client.queue:
-            if fen in self.queued_fens:
+            if key in self.queued_keys:
                 return False
-            self.queued_fens.add(fen)
-        await self.send_request.send((call, args))
+            self.queued_keys.add(key)
+        self.pending.append((call, args))
+        self._flush_pending()
         self.rs += 1
         return True
 
     async def read_response(self):
         '''read a request's response from the requesters. returns (api_call, args, result)'''
+        self._flush_pending() # If this can't flush everything, then the requesters are busy and will send us results
         results = await self.recv_results.receive()
         self.rp += 1
         return results
 
+    def _flush_pending(self):
+        while self.pending:
+            try:
+                self.send_request.send_nowait(self.pending[0])
+            except trio.WouldBlock:
+                return
+            self.pending.popleft()
+
     def stats(self):
         '''returns (requests sent, requests read)'''
         return self.rs, self.rp
@@ -200,6 +256,10 @@ class CircularRequesters:
                                   send_results:trio.MemoryReceiveChannel, j=None):
         #i=0
         #print(1, send_results._state.open_receive_channels)
+        # Each requester deliberately handles one request at a time. Draining several requests into a sub-nursery would
+        # put up to (batch size * concurrency) requests in flight, blowing past `client.concurrency`, which is the
+        # politeness cap for CDB. And it would save little: a channel receive is microseconds, an HTTP round trip is
+        # tens of milliseconds.
         with recv_request, send_results:
             #print(2, send_results._state.open_receive_channels)
             async for api_call, args in recv_request: # The loop wraps recv_request.receive(); idle tasks "block" there
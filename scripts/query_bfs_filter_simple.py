@@ -33,6 +33,10 @@ hits in a single PV or similar. Such variety checks should be applied before mak
 Being a "brute force" breadth-first iterator, the positions produced will have been reached by blunders, on average --
 but blunders that average out to passing the filter.
 
+Deep searches may exhaust memory with the breadth-first frontier and deduplication set. For those, use --low-memory,
+which spills the frontier to a temporary file and deduplicates with a compact hash table. Unlike --low-memory in
+queue_files_pgn.py, this deduplication is exact: no positions are wrongly skipped.
+
 Finally, for root positions other than the startpos, CDB is likely to not know most of these blundering positions.
 Therefore, running a non-startpos query twice, the second a day after the first, is likely to produce more filtered
 positions, after the CDB elves have processed the formerly-unknown blunder positions.
@@ -46,7 +50,7 @@ import trio
 import chess
 
 from noobchessdbpy.api import CDBStatus
-from noobchessdbpy.library import AsyncCDBLibrary, BreadthFirstState, CDBArgs
+from noobchessdbpy.library import AsyncCDBLibrary, CDBArgs, DiskDeque, Int64Set
 
 logging.basicConfig(
     format="%(levelname)s [%(asctime)s] %(name)s - %(message)s",
@@ -76,12 +80,15 @@ def well_biased_filter_formatter(board:chess.Board, cdb_json):
     return f"{cdb_json['moves'][0]['score']:>4} {cdb_json['moves'][1]['score']:>4} {board.fen()}"
 
 
-async def query_bfs_filter_simple(args):
-    '''Using any filter, query breadth-first for positions which pass the filter.'''
+async def query_bfs_filter_simple(args, handle=None):
+    '''Using any filter, query breadth-first for positions which pass the filter, writing each batch as it comes.'''
+    bfs_kwargs = {'queue': DiskDeque(), 'seen': Int64Set()} if args.low_memory else {}
     async with AsyncCDBLibrary(args=args) as lib:
-        filtered_poss = await lib.query_bfs_filter_simple(args.fen, well_biased_filter, args.target,
-                                                          args.ply, args.count, args.batchsize)
-    return filtered_poss
+        async for filtered_poss in lib.query_bfs_filter_simple(args.fen, well_biased_filter, args.target,
+                                                               args.ply, args.count, args.batchsize, **bfs_kwargs):
+            if handle and filtered_poss:
+                handle.write('\n'.join(well_biased_filter_formatter(board, json) for board, json in filtered_poss) + '\n')
+                handle.flush() # so that an interrupted search keeps everything found so far
 
 def main(args):
     if not args.count and not args.ply and not args.target:
@@ -93,12 +100,12 @@ def main(args):
     if args.target is None:
         args.target = math.inf
 
-    filtered_poss = trio.run(query_bfs_filter_simple, args)
-
     if args.output:
-        print(f"writing to {args.output}...")
+        print(f"writing to {args.output} as we go...")
         with open(args.output, 'w') as handle:
-            handle.write('\n'.join(well_biased_filter_formatter(board, json) for board, json in filtered_poss) + '\n')
+            trio.run(query_bfs_filter_simple, args, handle)
+    else:
+        trio.run(query_bfs_filter_simple, args)
     print("complete")
 
 parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -113,6 +120,9 @@ limits.add_argument('-t', '--target', type=int, help='stop after the target numb
 
 parser.add_argument('-b', '--batchsize', type=int,
                     help='this many queries between each filtering (default: a multiple of concurrency)')
+parser.add_argument('--low-memory', action='store_true',
+                    help="spill the breadth-first frontier to a temporary file, and deduplicate with a compact hash "
+                         "table, for searches too deep to hold in memory. Deduplication stays exact (not lossy)")
 CDBArgs.add_args_to_parser(parser, CDBArgs.Fen, CDBArgs.OutputFilename)
 CDBArgs.add_api_args_to_parser(parser)
 
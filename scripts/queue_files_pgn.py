@@ -20,7 +20,10 @@ This script reads PGN files, one at a time: read games from one file into memory
 (including variations and PVs stored in comments), deduplicate the positions, rinse and repeat, and cross-deduplicate
 between all files. Then mass-queue the cross-deduplicated positions into CDB.
 
-Caution: PGN parsing is painfully slow, and furthermore can consume *lots* of memory. Monitor memory usage.
+Caution: PGN parsing is painfully slow, and furthermore can consume *lots* of memory. Monitor memory usage. For really
+large inputs, use --low-memory, which spools unique positions to a temporary file and deduplicates with a Bloom filter
+sized by --expected-positions. This deduplication is lossy: a rare few unique positions are wrongly skipped as
+duplicates. Otherwise, use --processes to parse each file on several cores.
 
 Note: queue order is arbitrary.
 
@@ -33,11 +36,12 @@ One can also queue lines by pasting PGN directly on the command line, see queue_
 import argparse
 import logging
 import math
+import tempfile
 
 import trio
 import chess.pgn
 
-from noobchessdbpy.library import AsyncCDBLibrary, parse_pgn_to_set, CDBArgs
+from noobchessdbpy.library import AsyncCDBLibrary, parse_pgn_to_set, parse_pgn_to_set_parallel, BloomFilter, CDBArgs
 
 logging.basicConfig(
     format="%(levelname)s [%(asctime)s] %(name)s - %(message)s",
@@ -49,8 +53,11 @@ logging.basicConfig(
 def parse_pgns(args):
     all_positions, n, u_sub = set(), 0, 0
     for i, filename in enumerate(args.filenames):
-        with open(filename) as filehandle:
-            this_positions, x = parse_pgn_to_set(filehandle, args.start, args.count)
+        if args.processes:
+            this_positions, x = parse_pgn_to_set_parallel(filename, args.start, args.count, args.processes)
+        else:
+            with open(filename) as filehandle:
+                this_positions, x = parse_pgn_to_set(filehandle, args.start, args.count)
         n += x
         u_sub += len(this_positions)
         all_positions |= this_positions
@@ -60,13 +67,37 @@ def parse_pgns(args):
                   f"total, {u/n if n else math.nan:.2%} unique rate")
     return all_positions
 
+def parse_pgns_to_file(args, spool):
+    seen, n, u = BloomFilter(args.expected_positions), 0, 0
+    write = lambda fen: print(fen, file=spool)
+    for i, filename in enumerate(args.filenames):
+        with open(filename) as filehandle:
+            this_u, x = parse_pgn_to_set(filehandle, args.start, args.count, sink=write, seen=seen)
+        n += x
+        u += this_u
+        if i > 0:
+            print(f"after cross-deduplication, found {u} cross-unique positions from {n} "
+                  f"total, {u/n if n else math.nan:.2%} unique rate")
+
 async def mass_queue_set(args, all_positions):
     async with AsyncCDBLibrary(args=args) as lib:
         await lib.mass_queue_set(all_positions)
 
+async def mass_queue_stream(args, spool):
+    async with AsyncCDBLibrary(args=args) as lib:
+        await lib.mass_queue_stream(spool)
+
 def main(args):
-    all_positions = parse_pgns(args)
-    trio.run(mass_queue_set, args, all_positions)
+    if args.low_memory and args.processes:
+        parser.error("--processes and --low-memory are mutually exclusive")
+    if args.low_memory:
+        with tempfile.TemporaryFile('w+') as spool:
+            parse_pgns_to_file(args, spool)
+            spool.seek(0)
+            trio.run(mass_queue_stream, args, spool)
+    else:
+        all_positions = parse_pgns(args)
+        trio.run(mass_queue_set, args, all_positions)
 
 
 parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -74,6 +105,15 @@ parser.add_argument('filenames', nargs='+', help="A list of filenames to read PG
 CDBArgs.LimitCount.add_to_parser(parser, help='the maximum number of games to process from each file')
 parser.add_argument('-s', '--start', type=int, default=0,
                     help='the number of games to skip from the beginning of each file')
+parser.add_argument('-j', '--processes', type=int,
+                    help="parse each file with this many worker processes (not compatible with --low-memory)")
+parser.add_argument('--low-memory', action='store_true',
+                    help="spool positions to a temporary file, deduplicating with a Bloom filter. Lossy: a rare few "
+                         "unique positions are wrongly skipped as duplicates")
+parser.add_argument('--expected-positions', type=int, default=10_000_000, metavar='N',
+                    help="with --low-memory, size the Bloom filter for this many unique positions, about 4 bytes "
+                         "apiece. A generous estimate is fine; beyond it, more positions are wrongly skipped "
+                         "(default: %(default)s)")
 CDBArgs.add_api_args_to_parser(parser)
 
 if __name__ == '__main__':